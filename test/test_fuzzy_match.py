@@ -0,0 +1,33 @@
+from xiaomusic.utils import find_best_match
+
+SONGS = [
+    "周杰伦-晴天",
+    "周杰倫-稻香",
+    "林俊杰-江南",
+    "冰冰超人 - 八年的爱",
+    "冰冰超人 - 八年的爱新版",
+    "Taylor Swift - Love Story",
+    "其他",
+]
+
+
+def test_keyword_match():
+    # 包含关键词的直接命中，不区分繁简和大小写
+    assert find_best_match("晴天", SONGS) == ["周杰伦-晴天"]
+    assert find_best_match("稻香", SONGS) == ["周杰倫-稻香"]
+    assert find_best_match("love story", SONGS) == ["Taylor Swift - Love Story"]
+    assert find_best_match("周杰伦", SONGS, n=10) == ["周杰伦-晴天", "周杰倫-稻香"]
+    assert find_best_match("八年的爱", SONGS, n=10) == [
+        "冰冰超人 - 八年的爱",
+        "冰冰超人 - 八年的爱新版",
+    ]
+
+
+def test_fuzzy_match_cutoff():
+    # 没有关键词命中时按 fuzz.ratio 相似度和阈值比较
+    assert find_best_match("林俊杰江南", SONGS) == ["林俊杰-江南"]
+    assert find_best_match("江南林俊杰", SONGS) == []
+    assert find_best_match("江南林俊杰", SONGS, cutoff=0.4) == ["林俊杰-江南"]
+    assert find_best_match("夜曲", SONGS) == []
+    # fuzz.ratio 不低于 difflib 的 ratio，这里 difflib 只有 0.5，旧版匹配不到
+    assert find_best_match("周晴杰-天伦", SONGS) == ["周杰伦-晴天"]
@@ -0,0 +1,47 @@
+import asyncio
+
+from aiohttp import web
+
+from xiaomusic.utils import get_web_music_duration
+
+# MPEG1 Layer3 128kbps 44.1kHz 的帧头，每帧 417 字节，没有 Xing/VBRI 头
+_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+_FRAME_COUNT = 1000
+_CBR_MP3 = _FRAME * _FRAME_COUNT
+# 没有时长头信息时按文件大小估算
+_EXPECTED_SEC = len(_CBR_MP3) * 8 / 128000
+
+
+async def _get_duration(handler):
+    app = web.Application()
+    app.router.add_get("/song.mp3", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        return await get_web_music_duration(f"http://127.0.0.1:{port}/song.mp3")
+    finally:
+        await runner.cleanup()
+
+
+def test_ignore_range_returns_whole_file():
+    # 服务器忽略 Range，直接返回 200 和整个文件
+    async def handler(request):
+        return web.Response(body=_CBR_MP3, content_type="audio/mpeg")
+
+    duration, _ = asyncio.run(_get_duration(handler))
+    assert abs(duration - _EXPECTED_SEC) < 1
+
+
+def test_range_response_is_capped():
+    # 服务器支持 Range 时只返回请求的部分
+    async def handler(request):
+        start, end = request.http_range.start, request.http_range.stop
+        return web.Response(
+            status=206, body=_CBR_MP3[start:end], content_type="audio/mpeg"
+        )
+
+    duration, _ = asyncio.run(_get_duration(handler))
+    assert 0 < duration < _EXPECTED_SEC
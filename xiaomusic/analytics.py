@@ -4,16 +4,17 @@ import platform
 import traceback
 from datetime import datetime
 
-import aiohttp
 from ga4mp import GtagMP
 
 from xiaomusic import __version__
+from xiaomusic.utils import get_web_session
 
 
 class Analytics:
     def __init__(self, log, config):
         self.gtag = None
         self.current_date = None
+        self._user_agent = None  # 系统信息不会变，只生成一次
         self.log = log
         self.config = config
         self.init()
@@ -96,7 +97,8 @@ class Analytics:
             }
 
             self.log.info(f"umami data: {data}")
-            async with aiohttp.ClientSession() as session:
+            # 复用共享的 session，每次播放上报不用重新建立连接
+            async with get_web_session() as session:
                 headers = {
                     "User-Agent": user_agent,
                 }
@@ -108,6 +110,11 @@ class Analytics:
             self.log.exception(f"Execption {e}")
 
     def _get_user_agent(self):
+        if self._user_agent is None:
+            self._user_agent = self._gen_user_agent()
+        return self._user_agent
+
+    def _gen_user_agent(self):
         try:
             # 获取系统信息
             os_name = platform.system()  # 操作系统名称，如 'Windows', 'Linux', 'Darwin'
@@ -130,7 +130,8 @@ class Config:
     )
     use_music_id: str = os.getenv("XIAOMUSIC_USE_MUSIC_ID", "355454500")
     log_file: str = os.getenv("XIAOMUSIC_LOG_FILE", "xiaomusic.log.txt")
-    # 模糊搜索匹配的最低相似度阈值
+    # 模糊搜索匹配的最低相似度阈值，按 rapidfuzz 的 fuzz.ratio（编辑距离）计算
+    # 它不低于旧版 difflib 的相似度，同样的阈值会比旧版宽松一些，可以适当调高
     fuzzy_match_cutoff: float = float(os.getenv("XIAOMUSIC_FUZZY_MATCH_CUTOFF", "0.6"))
     # 开启模糊搜索
     enable_fuzzy_match: bool = (
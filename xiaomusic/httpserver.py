@@ -1,5 +1,4 @@
 import asyncio
-import hashlib
 import json
 import os
 import secrets
@@ -35,13 +34,16 @@ from starlette.responses import FileResponse, Response
 from xiaomusic import __version__
 from xiaomusic.utils import (
     chmoddir,
+    close_web_session,
     convert_file_to_mp3,
-    deepcopy_data_no_sensitive_info,
+    copy_data_no_sensitive_info,
     download_one_music,
     download_playlist,
     downloadfile,
+    get_access_control_code,
     get_latest_version,
     is_mp3,
+    open_web_session,
     remove_common_prefix,
     remove_id3_tags,
     restart_xiaomusic,
@@ -56,12 +58,17 @@ log = None
 
 @asynccontextmanager
 async def app_lifespan(app):
+    open_web_session()
     if xiaomusic is not None:
         asyncio.create_task(xiaomusic.run_forever())
     try:
         yield
     except Exception as e:
         log.exception(f"Execption {e}")
+    finally:
+        if xiaomusic is not None:
+            xiaomusic.flush_tag_cache()
+        await close_web_session()
 
 
 security = HTTPBasic()
@@ -231,7 +238,7 @@ async def do_cmd(data: DidCmd, Verifcation=Depends(verification)):
 
 @app.get("/cmdstatus")
 async def cmd_status(Verifcation=Depends(verification)):
-    finish = await xiaomusic.is_task_finish()
+    finish = xiaomusic.is_task_finish()
     if finish:
         return {"ret": "OK", "status": "finish"}
     return {"ret": "OK", "status": "running"}
@@ -255,7 +262,7 @@ async def savesetting(request: Request, Verifcation=Depends(verification)):
     try:
         data_json = await request.body()
         data = json.loads(data_json.decode("utf-8"))
-        debug_data = deepcopy_data_no_sensitive_info(data)
+        debug_data = copy_data_no_sensitive_info(data)
         log.info(f"saveconfig: {debug_data}")
         config = xiaomusic.getconfig()
         if data["password"] == "******" or data["password"] == "":
@@ -454,7 +461,7 @@ async def playtts(did: str, text: str, Verifcation=Depends(verification)):
 
 @app.post("/refreshmusictag")
 async def refreshmusictag(Verifcation=Depends(verification)):
-    xiaomusic.refresh_music_tag()
+    await xiaomusic.refresh_music_tag()
     return {
         "ret": "OK",
     }
@@ -670,7 +677,7 @@ def access_key_verification(file_path, key, code):
     if config.disable_httpauth:
         return True
 
-    log.debug(f"访问限制接收端[{file_path}, {key}, {code}]")
+    log.debug("访问限制接收端[%s, %s, %s]", file_path, key, code)
     if key is not None:
         current_key_bytes = key.encode("utf8")
         correct_key_bytes = (
@@ -682,15 +689,9 @@ def access_key_verification(file_path, key, code):
 
     if code is not None:
         current_code_bytes = code.encode("utf8")
-        correct_code_bytes = (
-            hashlib.sha256(
-                (
-                    file_path + config.httpauth_username + config.httpauth_password
-                ).encode("utf-8")
-            )
-            .hexdigest()
-            .encode("utf-8")
-        )
+        correct_code_bytes = get_access_control_code(
+            file_path, config.httpauth_username, config.httpauth_password
+        ).encode("utf-8")
         is_correct_code = secrets.compare_digest(correct_code_bytes, current_code_bytes)
         if is_correct_code:
             return True
@@ -1,14 +1,21 @@
 import importlib
 import inspect
 import pkgutil
+from collections import OrderedDict
 
 
 class PluginManager:
+    # 编译后的插件代码缓存的最大条数
+    _CODE_CACHE_MAX = 256
+
     def __init__(self, xiaomusic, plugin_dir="plugins"):
         self.xiaomusic = xiaomusic
         self.log = xiaomusic.log
         self._funcs = {}
+        self._code_cache = OrderedDict()  # key 为插件代码, value 为编译后的代码
         self._load_plugins(plugin_dir)
+        # 执行插件代码用的命名空间，只在加载时构建一次，插件函数优先
+        self._exec_namespace = {**globals(), **self._funcs}
 
     def _load_plugins(self, plugin_dir):
         # 假设 plugins 已经在搜索路径上
@@ -42,13 +49,25 @@ class PluginManager:
         """返回包含所有插件函数的字典，可以用作 exec 要执行的代码的命名空间"""
         return self._funcs.copy()
 
+    def _compile_code(self, code):
+        compiled = self._code_cache.get(code)
+        if compiled is None:
+            compiled = compile(code, "<plugin>", "eval")
+            self._code_cache[code] = compiled
+            if len(self._code_cache) > self._CODE_CACHE_MAX:
+                self._code_cache.popitem(last=False)
+        else:
+            self._code_cache.move_to_end(code)
+        return compiled
+
     async def execute_plugin(self, code):
         """
         执行指定的插件代码。插件函数可以是同步或异步。
         :param code: 需要执行的插件函数代码（例如 'plugin1("hello")'）
         """
         # 分解代码字符串以获取函数名
-        func_name = code.split("(")[0]
+        code = code.strip()
+        func_name = code.partition("(")[0]
 
         # 根据解析出的函数名从插件字典中获取函数
         plugin_func = self.get_func(func_name)
@@ -56,14 +75,13 @@ class PluginManager:
         if not plugin_func:
             raise ValueError(f"No plugin function named '{func_name}' found.")
 
+        compiled = self._compile_code(code)
         # 检查函数是否是异步函数
-        global_namespace = globals().copy()
-        local_namespace = self.get_local_namespace()
         if inspect.iscoroutinefunction(plugin_func):
             # 如果是异步函数，构建执行用的协程对象
-            coroutine = eval(code, global_namespace, local_namespace)
+            coroutine = eval(compiled, self._exec_namespace)
             # 等待协程执行
             await coroutine
         else:
             # 如果是普通函数，直接执行代码
-            eval(code, global_namespace, local_namespace)
+            eval(compiled, self._exec_namespace)
@@ -4,7 +4,7 @@ from __future__ import annotations
 import asyncio
 import base64
 import copy
-import difflib
+import functools
 import hashlib
 import io
 import json
@@ -20,8 +20,10 @@ import subprocess
 import tempfile
 import urllib.parse
 from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 from dataclasses import asdict, dataclass
 from http.cookies import SimpleCookie
+from types import MappingProxyType
 from urllib.parse import urlparse
 
 import aiohttp
@@ -47,7 +49,7 @@ from mutagen.oggvorbis import OggVorbis
 from mutagen.wave import WAVE
 from mutagen.wavpack import WavPack
 from opencc import OpenCC
-from PIL import Image
+from rapidfuzz import fuzz, process
 from requests.utils import cookiejar_from_dict
 
 from xiaomusic.const import SUPPORT_MUSIC_TYPE
@@ -79,12 +81,14 @@ _ending_punctuations = ("。", "？", "！", "；", ".", "?", "!", ";")
 
 
 async def split_sentences(text_stream: AsyncIterator[str]) -> AsyncIterator[str]:
-    cur = ""
+    # 先收集片段，整句结束时再拼接，避免长句反复拼接字符串
+    parts = []
     async for text in text_stream:
-        cur += text
-        if cur.endswith(_ending_punctuations):
-            yield cur
-            cur = ""
+        parts.append(text)
+        if text.endswith(_ending_punctuations):
+            yield "".join(parts)
+            parts.clear()
+    cur = "".join(parts)
     if cur:
         yield cur
 
@@ -115,10 +119,26 @@ def fuzzyfinder(user_input, collection, extra_search_index=None):
     )
 
 
+# 在预先生成的索引里模糊搜索
+def fuzzyfinder_in_index(user_input, search_index, extra_search_index=None):
+    return find_best_match_in_index(
+        user_input,
+        search_index,
+        cutoff=0.1,
+        n=10,
+        extra_search_index=extra_search_index,
+    )
+
+
 def traditional_to_simple(to_convert: str):
     return cc.convert(to_convert)
 
 
+# 搜索用的统一格式：小写简体
+def normalize_search_key(s):
+    return traditional_to_simple(s.lower())
+
+
 # 关键词检测
 def keyword_detection(user_input, str_list, n):
     # 过滤包含关键字的字符串
@@ -129,9 +149,15 @@ def keyword_detection(user_input, str_list, n):
         else:
             remains.append(item)
 
+    # 只要一个时用 max 找最相似的，不用整个排序
+    if n == 1 and matched:
+        best = max(matched, key=lambda s: fuzz.ratio(s, user_input))
+        matched.remove(best)
+        return [best], matched + remains
+
     matched = sorted(
         matched,
-        key=lambda s: difflib.SequenceMatcher(None, s, user_input).ratio(),
+        key=lambda s: fuzz.ratio(s, user_input),
         reverse=True,  # 降序排序，越相似的越靠前
     )
 
@@ -148,36 +174,67 @@ def real_search(prompt, candidates, cutoff, n):
     matches, remains = keyword_detection(prompt, candidates, n=n)
     if len(matches) < n:
         # 如果没有准确关键词匹配，开始模糊匹配
-        matches += difflib.get_close_matches(prompt, remains, n=n, cutoff=cutoff)
+        matches += [
+            match
+            for match, _, _ in process.extract(
+                prompt, remains, scorer=fuzz.ratio, limit=n, score_cutoff=cutoff * 100
+            )
+        ]
     return matches
 
 
 def find_best_match(user_input, collection, cutoff=0.6, n=1, extra_search_index=None):
-    lower_collection = {
-        traditional_to_simple(item.lower()): item for item in collection
-    }
-    user_input = traditional_to_simple(user_input.lower())
-    matches = real_search(user_input, lower_collection.keys(), cutoff, n)
-    cur_matched_collection = [lower_collection[match] for match in matches]
+    search_index = build_search_index(collection)
+    if extra_search_index is not None:
+        # 生成器只在需要额外搜索时才会做转换
+        extra_search_index = (
+            (normalize_search_key(k), v) for k, v in extra_search_index.items()
+        )
+    return find_best_match_in_index(
+        user_input, search_index, cutoff, n, extra_search_index
+    )
+
+
+# 搜索索引：key 为转成小写简体后的字符串, value 为原始字符串
+def build_search_index(collection):
+    return {normalize_search_key(item): item for item in collection}
+
+
+# 额外搜索索引：(转成小写简体后的 key, value) 列表
+def build_extra_search_index(extra_search_index):
+    return [(normalize_search_key(k), v) for k, v in extra_search_index.items()]
+
+
+# normalized 为 True 时 user_input 已经用 normalize_search_key 处理过
+def find_best_match_in_index(
+    user_input, search_index, cutoff=0.6, n=1, extra_search_index=None, normalized=False
+):
+    if not normalized:
+        user_input = normalize_search_key(user_input)
+    matches = real_search(user_input, search_index.keys(), cutoff, n)
+    cur_matched_collection = [search_index[match] for match in matches]
     if len(matches) >= n or extra_search_index is None:
         return cur_matched_collection[:n]
 
-    # 如果数量不满足，继续搜索
+    # 如果数量不满足，继续搜索，已匹配的歌曲用集合判断
+    matched_set = set(cur_matched_collection)
     lower_extra_search_index = {
-        traditional_to_simple(k.lower()): v
-        for k, v in extra_search_index.items()
-        if v not in cur_matched_collection
+        k: v for k, v in extra_search_index if v not in matched_set
     }
     matches = real_search(user_input, lower_extra_search_index.keys(), cutoff, n)
     cur_matched_collection += [lower_extra_search_index[match] for match in matches]
     return cur_matched_collection[:n]
 
 
+_numeric_prefix = re.compile(r"^(\d+)")
+_numeric_suffix = re.compile(r"(\d+)$")
+
+
 # 歌曲排序
 def custom_sort_key(s):
     # 使用正则表达式分别提取字符串的数字前缀和数字后缀
-    prefix_match = re.match(r"^(\d+)", s)
-    suffix_match = re.search(r"(\d+)$", s)
+    prefix_match = _numeric_prefix.match(s)
+    suffix_match = _numeric_suffix.search(s)
 
     numeric_prefix = int(prefix_match.group(0)) if prefix_match else None
     numeric_suffix = int(suffix_match.group(0)) if suffix_match else None
@@ -247,8 +304,8 @@ async def downloadfile(url):
     # 构建目标URL
     cleaned_url = parsed_url.geturl()
 
-    # 使用 aiohttp 创建一个客户端会话来发起请求
-    async with aiohttp.ClientSession() as session:
+    # 使用共享的 aiohttp 会话发起请求，复用连接
+    async with get_web_session() as session:
         async with session.get(
             cleaned_url, timeout=5
         ) as response:  # 增加超时以避免长时间挂起
@@ -270,18 +327,77 @@ def is_m4a(url):
     return url.endswith(".m4a")
 
 
-async def _get_web_music_duration(session, url, ffmpeg_location, start=0, end=500):
+# 网络请求共用的 session 和它所属的事件循环，由 app 的 lifespan 打开和关闭
+_web_session = None
+_web_session_loop = None
+
+
+# 复用连接池和 DNS 缓存，避免每次请求都重新建立连接
+def open_web_session():
+    global _web_session, _web_session_loop
+    if _web_session is None or _web_session.closed:
+        _web_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300)
+        )
+        _web_session_loop = asyncio.get_running_loop()
+    return _web_session
+
+
+# 有共用的 session 就直接用，否则（比如单独运行的脚本）临时创建一个，用完关闭
+@asynccontextmanager
+async def get_web_session():
+    session = _web_session
+    if (
+        session is not None
+        and not session.closed
+        and _web_session_loop is asyncio.get_running_loop()
+    ):
+        yield session
+    else:
+        async with aiohttp.ClientSession() as session:
+            yield session
+
+
+async def close_web_session():
+    global _web_session, _web_session_loop
+    if _web_session is not None and not _web_session.closed:
+        await _web_session.close()
+    _web_session = None
+    _web_session_loop = None
+
+
+async def _read_at_most(response, size):
+    chunks = []
+    while size > 0:
+        chunk = await response.content.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+async def _get_web_music_duration(
+    session, url, ffmpeg_location, start=0, end=500, timeout=None
+):
     duration = 0
     headers = {"Range": f"bytes={start}-{end}"}
-    async with session.get(url, headers=headers) as response:
-        array_buffer = await response.read()
+    async with session.get(url, headers=headers, timeout=timeout) as response:
+        if response.status == 206:
+            # 服务器按 Range 返回时最多读取需要的部分
+            array_buffer = await _read_at_most(response, end - start + 1)
+        else:
+            # 不支持 Range 时读取整个文件，没有时长头信息的歌曲要靠文件大小估算时长
+            array_buffer = await response.read()
     with tempfile.NamedTemporaryFile() as tmp:
         tmp.write(array_buffer)
         try:
             if is_mp3(url):
                 m = mutagen.mp3.MP3(tmp)
             elif is_m4a(url):
-                return get_duration_by_ffprobe(tmp, ffmpeg_location)
+                return await asyncio.get_running_loop().run_in_executor(
+                    None, get_duration_by_ffprobe, tmp, ffmpeg_location
+                )
             else:
                 m = mutagen.File(tmp)
             duration = m.info.length
@@ -290,32 +406,60 @@ async def _get_web_music_duration(session, url, ffmpeg_location, start=0, end=50
     return duration
 
 
+# 获取跳转后的真实地址，优先用 HEAD 请求，不下载歌曲内容
+async def _get_redirect_url(session, url):
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36"
+    }
+    timeout = aiohttp.ClientTimeout(total=10)
+    try:
+        async with session.head(
+            url, allow_redirects=True, headers=headers, timeout=timeout
+        ) as response:
+            if response.status < 400:
+                return str(response.url)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        log.info(f"HEAD {url} failed: {e!r}")
+    # 有些服务器不支持 HEAD，改用 GET 只取第一个字节
+    headers["Range"] = "bytes=0-0"
+    async with session.get(
+        url, allow_redirects=True, headers=headers, timeout=timeout
+    ) as response:
+        return str(response.url)
+
+
+# 获取网络歌曲当前的真实地址，没有歌曲后缀的地址才可能跳转
+async def get_web_music_real_url(url):
+    parsed_url = urlparse(url)
+    _, extension = os.path.splitext(parsed_url.path)
+    if extension.lower() in SUPPORT_MUSIC_TYPE:
+        return url
+    try:
+        async with get_web_session() as session:
+            return await _get_redirect_url(session, parsed_url.geturl())
+    except Exception as e:
+        log.error(f"Error get_web_music_real_url: {e!r}")
+    return url
+
+
 async def get_web_music_duration(url, ffmpeg_location="./ffmpeg/bin"):
     duration = 0
     try:
         parsed_url = urlparse(url)
         file_path = parsed_url.path
         _, extension = os.path.splitext(file_path)
-        if extension.lower() not in SUPPORT_MUSIC_TYPE:
-            cleaned_url = parsed_url.geturl()
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    cleaned_url,
-                    allow_redirects=True,
-                    headers={
-                        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36"
-                    },
-                ) as response:
-                    url = str(response.url)
-        # 设置总超时时间为3秒
-        timeout = aiohttp.ClientTimeout(total=3)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with get_web_session() as session:
+            if extension.lower() not in SUPPORT_MUSIC_TYPE:
+                cleaned_url = parsed_url.geturl()
+                url = await _get_redirect_url(session, cleaned_url)
+            # 设置总超时时间为3秒
+            timeout = aiohttp.ClientTimeout(total=3)
             duration = await _get_web_music_duration(
-                session, url, ffmpeg_location, start=0, end=500
+                session, url, ffmpeg_location, start=0, end=500, timeout=timeout
             )
             if duration <= 0:
                 duration = await _get_web_music_duration(
-                    session, url, ffmpeg_location, start=0, end=3000
+                    session, url, ffmpeg_location, start=0, end=3000, timeout=timeout
                 )
     except Exception as e:
         log.error(f"Error get_web_music_duration: {e}")
@@ -330,7 +474,10 @@ async def get_local_music_duration(filename, ffmpeg_location="./ffmpeg/bin"):
         if is_mp3(filename):
             m = await loop.run_in_executor(None, mutagen.mp3.MP3, filename)
         elif is_m4a(filename):
-            duration = get_duration_by_ffprobe(filename, ffmpeg_location)
+            # ffprobe 是子进程调用，放到线程池里避免阻塞事件循环
+            duration = await loop.run_in_executor(
+                None, get_duration_by_ffprobe, filename, ffmpeg_location
+            )
             return duration
         else:
             m = await loop.run_in_executor(None, mutagen.File, filename)
@@ -371,8 +518,12 @@ def get_random(length):
     return "".join(random.sample(string.ascii_letters + string.digits, length))
 
 
-# 深拷贝把敏感数据设置为*
-def deepcopy_data_no_sensitive_info(data, fields_to_anonymize=None):
+# 拷贝一份把敏感数据设置为*
+def copy_data_no_sensitive_info(data, fields_to_anonymize=None):
+    """
+    返回隐藏了敏感字段的浅拷贝，用于打印日志。
+    只替换第一层的敏感字段，嵌套的 dict/list 和原数据共用，不要修改返回值里的嵌套数据。
+    """
     if fields_to_anonymize is None:
         fields_to_anonymize = [
             "account",
@@ -381,7 +532,7 @@ def deepcopy_data_no_sensitive_info(data, fields_to_anonymize=None):
             "httpauth_password",
         ]
 
-    copy_data = copy.deepcopy(data)
+    copy_data = copy.copy(data)
 
     # 检查copy_data是否是字典或具有属性的对象
     if isinstance(copy_data, dict):
@@ -598,6 +749,10 @@ class Metadata:
             self.lyrics = info.get("lyrics", "")
 
 
+# 空的歌曲信息，只读，使用时需要复制一份
+EMPTY_METADATA = MappingProxyType(asdict(Metadata()))
+
+
 def _get_alltag_value(tags, k):
     v = tags.getall(k)
     if len(v) > 0:
@@ -654,6 +809,9 @@ def _save_picture(picture_data, save_root, file_path):
 
 
 def _resize_save_image(image_bytes, save_path, max_size=300):
+    # PIL 只在保存封面时用到，用到时再导入，加快启动
+    from PIL import Image
+
     # 将 bytes 转换为 PIL Image 对象
     image = None
     try:
@@ -692,11 +850,11 @@ def extract_audio_metadata(file_path, save_root):
     except Exception as e:
         log.warning(f"Error extract_audio_metadata file: {file_path} {e}")
     if audio is None:
-        return asdict(metadata)
+        return dict(EMPTY_METADATA)
 
     tags = audio.tags
     if tags is None:
-        return asdict(metadata)
+        return dict(EMPTY_METADATA)
 
     if isinstance(audio, MP3):
         metadata.title = _get_tag_value(tags, "TIT2")
@@ -1006,18 +1164,30 @@ def remove_common_prefix(directory):
             log.debug(f'Renamed: "{filename}" to "{new_filename}"')
 
 
+# 访问控制校验码，同一个路径和账号密码算出来的结果不变，缓存起来复用
+@functools.lru_cache(maxsize=4096)
+def get_access_control_code(file_path, username, password):
+    return hashlib.sha256((file_path + username + password).encode("utf-8")).hexdigest()
+
+
 def try_add_access_control_param(config, url):
     if config.disable_httpauth:
         return url
 
     url_parts = urllib.parse.urlparse(url)
     file_path = urllib.parse.unquote(url_parts.path)
-    correct_code = hashlib.sha256(
-        (file_path + config.httpauth_username + config.httpauth_password).encode(
-            "utf-8"
-        )
-    ).hexdigest()
-    log.debug(f"rewrite url: [{file_path}, {correct_code}]")
+    correct_code = get_access_control_code(
+        file_path, config.httpauth_username, config.httpauth_password
+    )
+    log.debug("rewrite url: [%s, %s]", file_path, correct_code)
+
+    # 没有参数时直接拼接，不用解析再重新生成
+    if (
+        url_parts.netloc
+        and url.startswith(("http://", "https://"))
+        and not any(c in url for c in "?#;")
+    ):
+        return f"{url}?code={correct_code}"
 
     # make new url
     parsed_get_args = dict(urllib.parse.parse_qsl(url_parts.query))
@@ -1,18 +1,21 @@
 #!/usr/bin/env python3
 import asyncio
 import copy
+import heapq
 import json
 import logging
 import math
 import os
 import random
 import re
+import sys
 import time
 import urllib.parse
 from collections import OrderedDict
 from dataclasses import asdict
 from logging.handlers import RotatingFileHandler
 
+import orjson
 from aiohttp import ClientSession, ClientTimeout
 from miservice import MiAccount, MiIOService, MiNAService, miio_command
 
@@ -38,17 +41,22 @@ from xiaomusic.const import (
 from xiaomusic.crontab import Crontab
 from xiaomusic.plugin import PluginManager
 from xiaomusic.utils import (
+    EMPTY_METADATA,
     Metadata,
+    build_extra_search_index,
+    build_search_index,
     chinese_to_number,
     chmodfile,
+    copy_data_no_sensitive_info,
     custom_sort_key,
-    deepcopy_data_no_sensitive_info,
     extract_audio_metadata,
-    find_best_match,
-    fuzzyfinder,
+    find_best_match_in_index,
+    fuzzyfinder_in_index,
     get_local_music_duration,
     get_web_music_duration,
+    get_web_music_real_url,
     list2str,
+    normalize_search_key,
     not_in_dirs,
     parse_cookie_string,
     parse_str_to_dict,
@@ -60,6 +68,22 @@ from xiaomusic.utils import (
 
 
 class XiaoMusic:
+    # 文件是否存在的缓存时间（秒）
+    _PATH_EXISTS_CACHE_SEC = 30
+    # tag cache 延迟保存的秒数，合并短时间内的多次修改
+    _TAG_CACHE_SAVE_DELAY_SEC = 5
+    # 生成 tag 时同时读取的文件数，以及每批处理的歌曲数
+    _TAG_GEN_CONCURRENCY = 4
+    _TAG_GEN_BATCH_SIZE = 64
+    # 歌曲时长缓存的最大条数
+    _MUSIC_DURATION_CACHE_MAX = 4096
+    # 网络歌曲获取时长失败后，多少秒内不再重试
+    _WEB_MUSIC_DURATION_FAIL_SEC = 60
+    # 本地歌曲地址缓存的最大条数
+    _FILE_URL_CACHE_MAX = 4096
+    # 搜索结果缓存的最大条数
+    _SEARCH_RESULT_CACHE_MAX = 128
+
     def __init__(self, config: Config):
         self.config = config
 
@@ -75,14 +99,30 @@ class XiaoMusic:
 
         self.all_music = {}
         self._all_radio = {}  # 电台列表
+        self._web_music = set()  # 网络歌曲名字
+        self._exists_cache = {}  # key 为文件路径, value 为 (过期时间, 是否存在)
+        # 歌曲时长缓存, 网络歌曲 key 为地址, 本地歌曲 key 为 (文件路径, 修改时间)
+        self._music_duration_cache = OrderedDict()
+        # 获取时长失败的网络歌曲, key 为歌曲地址, value 为过期时间
+        self._web_music_duration_fail = OrderedDict()
+        self._web_music_duration_tasks = {}  # 正在获取时长的任务, key 为歌曲地址
         self.music_list = {}  # 播放列表 key 为目录名, value 为 play_list
         self.default_music_list_names = []  # 非自定义个歌单
+        self._default_music_list_names_set = frozenset()  # 用于快速判断
         self.devices = {}  # key 为 did
         self.running_task = []
         self.all_music_tags = {}  # 歌曲额外信息
+        self._tag_cache_loaded = False  # tag cache 文件是否已加载到内存
         self._tag_generation_task = False
+        self._tag_cache_save_handle = None  # 延迟保存 tag cache 的定时器
         self._extra_index_search = {}
+        self._search_index = {}  # 模糊搜索用的歌曲名索引
+        self._extra_search_index = []  # 模糊搜索用的文件路径索引
+        self._search_result_cache = {}  # 搜索结果缓存，索引变化时清空
+        # 播放列表名的搜索索引, (列表名元组, 索引)
+        self._music_list_search_index = ((), {})
         self.custom_play_list = None
+        self._music_list_json_cache = None  # (music_list_json, 解析结果)
 
         # 初始化配置
         self.init_config()
@@ -108,7 +148,7 @@ class XiaoMusic:
         # 启动统计
         self.analytics = Analytics(self.log, self.config)
 
-        debug_config = deepcopy_data_no_sensitive_info(self.config)
+        debug_config = copy_data_no_sensitive_info(self.config)
         self.log.info(f"Startup OK. {debug_config}")
 
         if self.config.conf_path == self.music_path:
@@ -130,6 +170,11 @@ class XiaoMusic:
         self.public_port = self.config.public_port
         if self.public_port == 0:
             self.public_port = self.port
+        # 歌曲和图片访问地址前缀，配置变更时重新生成
+        self._music_url_prefix = f"{self.hostname}:{self.public_port}/music/"
+        self._picture_url_prefix = f"{self.hostname}:{self.public_port}/picture/"
+        # 地址和配置相关，配置变化时清空
+        self._file_url_cache = OrderedDict()
 
         self.active_cmd = self.config.active_cmd.split(",")
         self.exclude_dirs = set(self.config.exclude_dirs.split(","))
@@ -184,7 +229,7 @@ class XiaoMusic:
                     continue
 
                 self.log.debug(
-                    f"Listening new message, timestamp: {self.last_timestamp}"
+                    "Listening new message, timestamp: %s", self.last_timestamp
                 )
                 session._cookie_jar = self.cookie_jar
 
@@ -366,13 +411,16 @@ class XiaoMusic:
                 device_id, "nlp_result_get", "mibrain", {}
             )
             self.log.debug(
-                f"get_latest_ask_by_mina device_id:{device_id} did:{did} response:{response}"
+                "get_latest_ask_by_mina device_id:%s did:%s response:%s",
+                device_id,
+                did,
+                response,
             )
             if d := response.get("data", {}).get("info", {}):
-                result = json.loads(d).get("result", [{}])
+                result = orjson.loads(d).get("result", [{}])
                 if result and len(result) > 0 and result[0].get("nlp"):
                     answers = (
-                        json.loads(result[0]["nlp"])
+                        orjson.loads(result[0]["nlp"])
                         .get("response", {})
                         .get("answer", [{}])
                     )
@@ -393,9 +441,11 @@ class XiaoMusic:
 
     def _get_last_query(self, device_id, data):
         did = self.get_did(device_id)
-        self.log.debug(f"_get_last_query device_id:{device_id} did:{did} data:{data}")
+        self.log.debug(
+            "_get_last_query device_id:%s did:%s data:%s", device_id, did, data
+        )
         if d := data.get("data"):
-            records = json.loads(d).get("records")
+            records = orjson.loads(d).get("records")
             if not records:
                 return
             last_record = records[0]
@@ -418,25 +468,33 @@ class XiaoMusic:
             self.new_record_event.set()
 
     def get_filename(self, name):
-        if name not in self.all_music:
+        filename = self.all_music.get(name)
+        if filename is None:
             self.log.info(f"get_filename not in. name:{name}")
             return ""
-        filename = self.all_music[name]
-        self.log.info(f"try get_filename. filename:{filename}")
-        if os.path.exists(filename):
+        self.log.debug("try get_filename. filename:%s", filename)
+        if self._path_exists(filename):
             return filename
         return ""
 
+    # 判断文件是否存在，结果缓存一段时间，减少挂载网盘时的 stat 调用
+    def _path_exists(self, path):
+        now = time.monotonic()
+        cached = self._exists_cache.get(path)
+        if cached and cached[0] > now:
+            return cached[1]
+        exists = os.path.exists(path)
+        self._exists_cache[path] = (now + self._PATH_EXISTS_CACHE_SEC, exists)
+        return exists
+
     # 判断本地音乐是否存在，网络歌曲不判断
     def is_music_exist(self, name):
-        if name not in self.all_music:
+        filename = self.all_music.get(name)
+        if filename is None:
             return False
         if self.is_web_music(name):
             return True
-        filename = self.get_filename(name)
-        if filename:
-            return True
-        return False
+        return self._path_exists(filename)
 
     # 是否是网络电台
     def is_web_radio_music(self, name):
@@ -444,42 +502,114 @@ class XiaoMusic:
 
     # 是否是网络歌曲
     def is_web_music(self, name):
-        if name not in self.all_music:
-            return False
-        url = self.all_music[name]
-        return url.startswith(("http://", "https://"))
+        return name in self._web_music
 
     # 获取歌曲播放时长，播放地址
     async def get_music_sec_url(self, name):
         sec = 0
         url = self.get_music_url(name)
-        self.log.info(f"get_music_sec_url. name:{name} url:{url}")
+        self.log.info("get_music_sec_url. name:%s url:%s", name, url)
         if self.is_web_radio_music(name):
             self.log.info("电台不会有播放时长")
             return 0, url
 
         if self.is_web_music(name):
             origin_url = url
-            duration, url = await get_web_music_duration(
-                url, self.config.ffmpeg_location
-            )
+            cached_sec = self._get_music_duration_cache(origin_url)
+            if cached_sec is not None:
+                # 跳转后的地址可能很快过期，只缓存时长，地址每次重新获取
+                url = await get_web_music_real_url(origin_url)
+                self.log.info(
+                    "网络歌曲 %s : %s %s 的时长 %d 秒(缓存)",
+                    name,
+                    origin_url,
+                    url,
+                    cached_sec,
+                )
+                return cached_sec, url
+            if self._is_web_music_duration_failed(origin_url):
+                self.log.info("网络歌曲 %s : %s 最近获取时长失败，跳过", name, url)
+                return 0, url
+            duration, url = await self._get_web_music_duration_once(url)
             sec = math.ceil(duration)
-            self.log.info(f"网络歌曲 {name} : {origin_url} {url} 的时长 {sec} 秒")
+            self.log.info(
+                "网络歌曲 %s : %s %s 的时长 %d 秒", name, origin_url, url, sec
+            )
+            if sec > 0:
+                self._set_music_duration_cache(origin_url, sec)
+            elif url == origin_url:
+                # 有跳转的不记录失败，下次还要重新获取跳转后的地址
+                self._set_web_music_duration_failed(origin_url)
         else:
             filename = self.get_filename(name)
-            self.log.info(f"get_music_sec_url. name:{name} filename:{filename}")
-            duration = await get_local_music_duration(
-                filename, self.config.ffmpeg_location
-            )
-            sec = math.ceil(duration)
-            self.log.info(f"本地歌曲 {name} : {filename} {url} 的时长 {sec} 秒")
+            self.log.info("get_music_sec_url. name:%s filename:%s", name, filename)
+            # 文件修改后时长可能变化，修改时间也作为 key 的一部分
+            try:
+                cache_key = (filename, os.path.getmtime(filename))
+            except OSError:
+                cache_key = None
+            cached_sec = cache_key and self._get_music_duration_cache(cache_key)
+            if cached_sec:
+                sec = cached_sec
+            else:
+                duration = await get_local_music_duration(
+                    filename, self.config.ffmpeg_location
+                )
+                sec = math.ceil(duration)
+                if sec > 0 and cache_key:
+                    self._set_music_duration_cache(cache_key, sec)
+            self.log.info("本地歌曲 %s : %s %s 的时长 %d 秒", name, filename, url, sec)
 
         if sec <= 0:
-            self.log.warning(f"获取歌曲时长失败 {name} {url}")
+            self.log.warning("获取歌曲时长失败 %s %s", name, url)
         return sec, url
 
+    # 多个设备同时播放同一首网络歌曲时，只获取一次时长
+    async def _get_web_music_duration_once(self, url):
+        task = self._web_music_duration_tasks.get(url)
+        if task is None:
+            task = asyncio.ensure_future(
+                get_web_music_duration(url, self.config.ffmpeg_location)
+            )
+            self._web_music_duration_tasks[url] = task
+            task.add_done_callback(
+                lambda _: self._web_music_duration_tasks.pop(url, None)
+            )
+        # 一个调用方被取消时不影响其他等待的调用方
+        return await asyncio.shield(task)
+
+    def _get_music_duration_cache(self, key):
+        sec = self._music_duration_cache.get(key)
+        if sec is not None:
+            self._music_duration_cache.move_to_end(key)
+        return sec
+
+    def _set_music_duration_cache(self, key, sec):
+        self._music_duration_cache[key] = sec
+        self._music_duration_cache.move_to_end(key)
+        # 超出上限时淘汰最久没用的
+        if len(self._music_duration_cache) > self._MUSIC_DURATION_CACHE_MAX:
+            self._music_duration_cache.popitem(last=False)
+
+    def _is_web_music_duration_failed(self, url):
+        expire = self._web_music_duration_fail.get(url)
+        if expire is None:
+            return False
+        if expire > time.monotonic():
+            return True
+        del self._web_music_duration_fail[url]
+        return False
+
+    def _set_web_music_duration_failed(self, url):
+        self._web_music_duration_fail[url] = (
+            time.monotonic() + self._WEB_MUSIC_DURATION_FAIL_SEC
+        )
+        self._web_music_duration_fail.move_to_end(url)
+        if len(self._web_music_duration_fail) > self._MUSIC_DURATION_CACHE_MAX:
+            self._web_music_duration_fail.popitem(last=False)
+
     def get_music_tags(self, name):
-        tags = copy.copy(self.all_music_tags.get(name, asdict(Metadata())))
+        tags = dict(self.all_music_tags.get(name) or EMPTY_METADATA)
         picture = tags["picture"]
         if picture:
             if picture.startswith(self.config.picture_cache_path):
@@ -489,8 +619,7 @@ class XiaoMusic:
                 picture = picture[1:]
             encoded_name = urllib.parse.quote(picture)
             tags["picture"] = try_add_access_control_param(
-                self.config,
-                f"{self.hostname}:{self.public_port}/picture/{encoded_name}",
+                self.config, self._picture_url_prefix + encoded_name
             )
         return tags
 
@@ -499,7 +628,7 @@ class XiaoMusic:
         if self._tag_generation_task:
             self.log.info("tag 更新中，请等待")
             return "Tag generation task running"
-        tags = copy.copy(self.all_music_tags.get(name, asdict(Metadata())))
+        tags = dict(self.all_music_tags.get(name) or EMPTY_METADATA)
         tags["title"] = info.title
         tags["artist"] = info.artist
         tags["album"] = info.album
@@ -514,58 +643,80 @@ class XiaoMusic:
         if self.config.enable_save_tag and (not self.is_web_music(name)):
             set_music_tag_to_file(file_path, Metadata(tags))
         self.all_music_tags[name] = tags
-        self.try_save_tag_cache()
+        self.try_save_tag_cache_later()
         return "OK"
 
     def get_music_url(self, name):
         if self.is_web_music(name):
             url = self.all_music[name]
-            self.log.info(f"get_music_url web music. name:{name}, url:{url}")
+            self.log.debug("get_music_url web music. name:%s, url:%s", name, url)
             return url
 
         filename = self.get_filename(name)
+        self.log.debug(
+            "get_music_url local music. name:%s, filename:%s", name, filename
+        )
+        return self._get_file_url(filename)
 
-        # 构造音乐文件的URL
-        if filename.startswith(self.config.music_path):
-            filename = filename[len(self.config.music_path) :]
-        filename = filename.replace("\\", "/")
-        if filename.startswith("/"):
-            filename = filename[1:]
-
-        self.log.info(f"get_music_url local music. name:{name}, filename:{filename}")
-
-        encoded_name = urllib.parse.quote(filename)
+    # 构造音乐文件的URL
+    def _get_file_url(self, filename):
+        url = self._file_url_cache.get(filename)
+        if url is not None:
+            self._file_url_cache.move_to_end(filename)
+            return url
+        url = self._build_file_url(filename)
+        self._file_url_cache[filename] = url
+        if len(self._file_url_cache) > self._FILE_URL_CACHE_MAX:
+            self._file_url_cache.popitem(last=False)
+        return url
+
+    def _build_file_url(self, filename):
+        filename = (
+            filename.removeprefix(self.music_path).replace("\\", "/").removeprefix("/")
+        )
+        encoded_name = urllib.parse.quote_from_bytes(filename.encode("utf-8"), b"/")
         return try_add_access_control_param(
-            self.config,
-            f"{self.hostname}:{self.public_port}/music/{encoded_name}",
+            self.config, self._music_url_prefix + encoded_name
         )
 
     # 给前端调用
-    def refresh_music_tag(self):
+    async def refresh_music_tag(self):
         if not self.ensure_single_thread_for_tag():
             return
-        filename = self.config.tag_cache_path
-        if filename is not None:
-            # 清空 cache
-            with open(filename, "w", encoding="utf-8") as f:
-                json.dump({}, f, ensure_ascii=False, indent=2)
-            self.log.info("刷新：已清空 tag cache")
-        else:
-            self.log.info("刷新：tag cache 未启用")
-        # TODO: 优化性能？
-        # TODO 如何安全的清空 picture_cache_path
-        self.all_music_tags = {}  # 需要清空内存残留
+        # 清空文件期间占住标记，避免此时开始的 tag 生成把旧数据写回去
+        self._tag_generation_task = True
+        try:
+            # 先清空内存残留，并取消还没执行的延迟保存
+            if self._tag_cache_save_handle is not None:
+                self._tag_cache_save_handle.cancel()
+                self._tag_cache_save_handle = None
+            # TODO 如何安全的清空 picture_cache_path
+            self.all_music_tags = {}
+            self._exists_cache = {}
+            filename = self.config.tag_cache_path
+            if filename is not None:
+                # 清空 cache，放到线程里写文件，避免阻塞事件循环
+                await asyncio.to_thread(self._clear_tag_cache_file, filename)
+                self.log.info("刷新：已清空 tag cache")
+            else:
+                self.log.info("刷新：tag cache 未启用")
+        finally:
+            self._tag_generation_task = False
         self.try_gen_all_music_tag()
         self.log.info("刷新：已启动重建 tag cache")
 
+    def _clear_tag_cache_file(self, filename):
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump({}, f, ensure_ascii=False, indent=2)
+
     def try_load_from_tag_cache(self) -> dict:
         filename = self.config.tag_cache_path
         tag_cache = {}
         try:
             if filename is not None:
                 if os.path.exists(filename):
-                    with open(filename, encoding="utf-8") as f:
-                        tag_cache = json.load(f)
+                    with open(filename, "rb") as f:
+                        tag_cache = orjson.loads(f.read())
                     self.log.info(f"已从【{filename}】加载 tag cache")
                 else:
                     self.log.info(f"【{filename}】tag cache 已启用，但文件不存在")
@@ -575,15 +726,38 @@ class XiaoMusic:
             self.log.exception(f"Execption {e}")
         return tag_cache
 
+    # 延迟保存 tag cache，短时间内多次修改只写一次文件
+    def try_save_tag_cache_later(self):
+        if self._tag_cache_save_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.try_save_tag_cache()
+            return
+        self._tag_cache_save_handle = loop.call_later(
+            self._TAG_CACHE_SAVE_DELAY_SEC, self.try_save_tag_cache
+        )
+
     def try_save_tag_cache(self):
+        if self._tag_cache_save_handle is not None:
+            self._tag_cache_save_handle.cancel()
+            self._tag_cache_save_handle = None
         filename = self.config.tag_cache_path
         if filename is not None:
-            with open(filename, "w", encoding="utf-8") as f:
-                json.dump(self.all_music_tags, f, ensure_ascii=False, indent=2)
+            # 先序列化再打开文件，出错时不会留下被截断的文件
+            data = orjson.dumps(self.all_music_tags, option=orjson.OPT_INDENT_2)
+            with open(filename, "wb") as f:
+                f.write(data)
             self.log.info(f"保存：tag cache 已保存到【{filename}】")
         else:
             self.log.info("保存：tag cache 未启用")
 
+    # 退出前把还在等待的延迟保存立即写入文件
+    def flush_tag_cache(self):
+        if self._tag_cache_save_handle is not None:
+            self.try_save_tag_cache()
+
     def ensure_single_thread_for_tag(self):
         if self._tag_generation_task:
             self.log.info("tag 更新中，请等待")
@@ -600,46 +774,80 @@ class XiaoMusic:
 
     async def _gen_all_music_tag(self, only_items: dict = None):
         self._tag_generation_task = True
-        if only_items is None:
+        update_all = only_items is None
+        if update_all:
             only_items = self.all_music  # 默认更新全部
 
-        all_music_tags = self.try_load_from_tag_cache()
-        all_music_tags.update(self.all_music_tags)  # 保证最新
+        if self._tag_cache_loaded:
+            # 内存中已经是最新的，不用再读文件
+            all_music_tags = dict(self.all_music_tags)
+        else:
+            # 只在首次从文件加载，放到线程里避免阻塞事件循环
+            all_music_tags = await asyncio.to_thread(self.try_load_from_tag_cache)
+            all_music_tags.update(self.all_music_tags)  # 保证最新
+            self._tag_cache_loaded = True
 
         ignore_tag_absolute_dirs = self.config.get_ignore_tag_dirs()
         self.log.info(f"ignore_tag_absolute_dirs: {ignore_tag_absolute_dirs}")
-        for name, file_or_url in only_items.items():
-            start = time.perf_counter()
-            if name not in all_music_tags:
+        loop = asyncio.get_running_loop()
+        sem = asyncio.Semaphore(self._TAG_GEN_CONCURRENCY)
+        picture_cache_path = self.config.picture_cache_path
+
+        # 在线程池里读取歌曲信息，多个文件的读取可以同时进行
+        async def _gen_one_tag(name, file_or_url):
+            async with sem:
+                start = time.perf_counter()
+                tags = None
                 try:
                     if self.is_web_music(name):
                         # TODO: 网络歌曲获取歌曲额外信息
                         pass
-                    elif os.path.exists(file_or_url) and not_in_dirs(
+                    elif self._path_exists(file_or_url) and not_in_dirs(
                         file_or_url, ignore_tag_absolute_dirs
                     ):
-                        all_music_tags[name] = extract_audio_metadata(
-                            file_or_url, self.config.picture_cache_path
+                        tags = await loop.run_in_executor(
+                            None,
+                            extract_audio_metadata,
+                            file_or_url,
+                            picture_cache_path,
                         )
                     else:
                         self.log.info(f"{name}/{file_or_url} 无法更新 tag")
-                except BaseException as e:
+                except Exception as e:
                     self.log.exception(f"{e} {file_or_url} error {type(file_or_url)}!")
-            if (time.perf_counter() - start) < 1:
-                await asyncio.sleep(0.001)
-            else:
-                # 处理一首歌超过1秒，则等1秒，解决挂载网盘卡死的问题
-                await asyncio.sleep(1)
+                if (time.perf_counter() - start) >= 1:
+                    # 处理一首歌超过1秒，则等1秒，解决挂载网盘卡死的问题
+                    await asyncio.sleep(1)
+                return name, tags
+
+        # 先取快照，避免处理过程中歌曲列表被修改
+        pending = [
+            (name, file_or_url)
+            for name, file_or_url in only_items.items()
+            if name not in all_music_tags
+        ]
+        batch_size = self._TAG_GEN_BATCH_SIZE
+        for i in range(0, len(pending), batch_size):
+            results = await asyncio.gather(
+                *(_gen_one_tag(name, f) for name, f in pending[i : i + batch_size])
+            )
+            for name, tags in results:
+                if tags is not None:
+                    all_music_tags[name] = tags
         # 全部更新结束后，一次性赋值
         self.all_music_tags = all_music_tags
-        # 刷新 tag cache
-        self.try_save_tag_cache()
+        # 刷新 tag cache，只更新部分歌曲时（比如下载）合并保存
+        if update_all:
+            self.try_save_tag_cache()
+        else:
+            self.try_save_tag_cache_later()
         self._tag_generation_task = False
         self.log.info("tag 更新完成")
 
     # 获取目录下所有歌曲,生成随机播放列表
     def _gen_all_music_list(self):
         self.all_music = {}
+        self._exists_cache = {}
         all_music_by_dir = {}
         local_musics = traverse_music_directory(
             self.music_path,
@@ -647,24 +855,30 @@ class XiaoMusic:
             exclude_dirs=self.exclude_dirs,
             support_extension=SUPPORT_MUSIC_TYPE,
         )
+        # 主目录和下载目录的名字只需计算一次
+        music_basename = os.path.basename(self.music_path)
+        download_basename = (
+            os.path.basename(self.download_path)
+            if self.music_path != self.download_path
+            else None
+        )
         for dir_name, files in local_musics.items():
             if len(files) == 0:
                 continue
-            if dir_name == os.path.basename(self.music_path):
+            if dir_name == music_basename:
                 dir_name = "其他"
-            if self.music_path != self.download_path and dir_name == os.path.basename(
-                self.download_path
-            ):
+            if download_basename is not None and dir_name == download_basename:
                 dir_name = "下载"
-            if dir_name not in all_music_by_dir:
-                all_music_by_dir[dir_name] = {}
+            dir_musics = all_music_by_dir.setdefault(dir_name, set())
             for file in files:
                 # 歌曲名字相同会覆盖
                 filename = os.path.basename(file)
                 (name, _) = os.path.splitext(filename)
+                # 同一个歌名会存到多个列表和字典里，共用一份字符串
+                name = sys.intern(name)
                 self.all_music[name] = file
-                all_music_by_dir[dir_name][name] = True
-                self.log.debug(f"_gen_all_music_list {name}:{dir_name}:{file}")
+                dir_musics.add(name)
+                self.log.debug("_gen_all_music_list %s:%s:%s", name, dir_name, file)
 
         # self.log.debug(self.all_music)
 
@@ -680,12 +894,12 @@ class XiaoMusic:
                 "最近新增": [],  # 按文件时间排序
             }
         )
-        # 最近新增(不包含网络歌单)
-        self.music_list["最近新增"] = sorted(
+        # 最近新增(不包含网络歌单)，只取前 N 个，不需要全量排序
+        self.music_list["最近新增"] = heapq.nlargest(
+            self.config.recently_added_playlist_len,
             self.all_music.keys(),
             key=lambda x: os.path.getmtime(self.all_music[x]),
-            reverse=True,
-        )[: self.config.recently_added_playlist_len]
+        )
 
         # 网络歌单
         try:
@@ -702,15 +916,17 @@ class XiaoMusic:
 
         # 文件夹歌单
         for dir_name, musics in all_music_by_dir.items():
-            self.music_list[dir_name] = list(musics.keys())
+            self.music_list[dir_name] = list(musics)
             # self.log.debug("dir_name:%s, list:%s", dir_name, self.music_list[dir_name])
 
-        # 歌单排序
+        # 歌单排序，同一首歌会出现在多个歌单里，排序 key 只计算一次
+        sort_keys = {name: custom_sort_key(name) for name in self.all_music}
         for _, play_list in self.music_list.items():
-            play_list.sort(key=custom_sort_key)
+            play_list.sort(key=sort_keys.__getitem__)
 
         # 非自定义个歌单
         self.default_music_list_names = list(self.music_list.keys())
+        self._default_music_list_names_set = frozenset(self.default_music_list_names)
 
         # 刷新自定义歌单
         self.refresh_custom_play_list()
@@ -720,19 +936,35 @@ class XiaoMusic:
 
         # 重建索引
         self._extra_index_search = {}
+        self._web_music = set()
         for k, v in self.all_music.items():
-            # 如果不是 url，则增加索引
-            if not (v.startswith("http") or v.startswith("https")):
+            if v.startswith(("http://", "https://")):
+                self._web_music.add(k)
+            else:
+                # 如果不是 url，则增加索引
                 self._extra_index_search[v] = k
+        self._search_index = build_search_index(self.all_music.keys())
+        self._extra_search_index = build_extra_search_index(self._extra_index_search)
+        self._search_result_cache = {}
 
         # all_music 更新，重建 tag
         self.try_gen_all_music_tag()
 
-    def refresh_custom_play_list(self):
+    # changed_names 不为空时只刷新有变动的自定义歌单
+    def refresh_custom_play_list(self, changed_names=None):
         try:
+            if changed_names is not None:
+                custom_play_list = self.get_custom_play_list()
+                for k in changed_names:
+                    if k in custom_play_list:
+                        self.music_list[k] = list(custom_play_list[k])
+                    elif k not in self._default_music_list_names_set:
+                        self.music_list.pop(k, None)
+                return
+
             # 删除旧的自定义个歌单
             for k in list(self.music_list.keys()):
-                if k not in self.default_music_list_names:
+                if k not in self._default_music_list_names_set:
                     del self.music_list[k]
             # 合并新的自定义个歌单
             custom_play_list = self.get_custom_play_list()
@@ -747,7 +979,7 @@ class XiaoMusic:
             return
 
         self._all_radio = {}
-        music_list = json.loads(self.config.music_list_json)
+        music_list = self._load_music_list_json()
         try:
             for item in music_list:
                 list_name = item.get("name")
@@ -761,6 +993,7 @@ class XiaoMusic:
                     music_type = music.get("type")
                     if (not name) or (not url):
                         continue
+                    name = sys.intern(name)
                     self.all_music[name] = url
                     one_music_list.append(name)
 
@@ -777,6 +1010,15 @@ class XiaoMusic:
         except Exception as e:
             self.log.exception(f"Execption {e}")
 
+    # 解析网络歌单配置，配置没变时复用上次的解析结果
+    def _load_music_list_json(self):
+        music_list_json = self.config.music_list_json
+        cache = self._music_list_json_cache
+        if cache is None or cache[0] != music_list_json:
+            cache = (music_list_json, orjson.loads(music_list_json))
+            self._music_list_json_cache = cache
+        return cache[1]
+
     async def analytics_task_daily(self):
         while True:
             await self.analytics.send_daily_event()
@@ -845,7 +1087,7 @@ class XiaoMusic:
         await asyncio.gather(*self.running_task, return_exceptions=True)
         self.running_task = []
 
-    async def is_task_finish(self):
+    def is_task_finish(self):
         if len(self.running_task) == 0:
             return True
         task = self.running_task[0]
@@ -925,23 +1167,31 @@ class XiaoMusic:
             self.log.debug("没开启模糊匹配")
             return name
 
-        all_music_list = list(self.all_music.keys())
-        real_names = find_best_match(
-            name,
-            all_music_list,
+        # 歌名完全一致时直接返回，不用再模糊匹配
+        if name in self.all_music:
+            self.log.info(f"根据【{name}】找到歌曲【{[name]}】")
+            return [name]
+
+        # 关键词只做一次繁简转换，扩大范围再找时复用
+        search_key = normalize_search_key(name)
+        real_names = find_best_match_in_index(
+            search_key,
+            self._search_index,
             cutoff=self.config.fuzzy_match_cutoff,
             n=n,
-            extra_search_index=self._extra_index_search,
+            extra_search_index=self._extra_search_index,
+            normalized=True,
         )
         if real_names:
             if n > 1 and name not in real_names:
                 # 模糊匹配模式，扩大范围再找，最后保留随机 n 个
-                real_names = find_best_match(
-                    name,
-                    all_music_list,
+                real_names = find_best_match_in_index(
+                    search_key,
+                    self._search_index,
                     cutoff=self.config.fuzzy_match_cutoff,
                     n=n * 2,
-                    extra_search_index=self._extra_index_search,
+                    extra_search_index=self._extra_search_index,
+                    normalized=True,
                 )
                 random.shuffle(real_names)
                 real_names = real_names[:n]
@@ -1009,9 +1259,9 @@ class XiaoMusic:
             return list_name
 
         # 模糊搜一个播放列表（只需要一个，不需要 extra index）
-        real_name = find_best_match(
+        real_name = find_best_match_in_index(
             list_name,
-            self.music_list,
+            self._get_music_list_search_index(),
             cutoff=self.config.fuzzy_match_cutoff,
             n=1,
         )[0]
@@ -1022,6 +1272,15 @@ class XiaoMusic:
             self.log.info(f"没找到播放列表【{list_name}】")
         return list_name
 
+    # 列表名没变时复用索引，不用每次都做繁简转换
+    def _get_music_list_search_index(self):
+        names = tuple(self.music_list)
+        cached_names, search_index = self._music_list_search_index
+        if names != cached_names:
+            search_index = build_search_index(names)
+            self._music_list_search_index = (names, search_index)
+        return search_index
+
     # 播放一个播放列表
     async def play_music_list(self, did="", arg1="", **kwargs):
         parts = arg1.split("|")
@@ -1150,14 +1409,14 @@ class XiaoMusic:
         if self.custom_play_list is None:
             self.custom_play_list = {}
             if self.config.custom_play_list_json:
-                self.custom_play_list = json.loads(self.config.custom_play_list_json)
+                self.custom_play_list = orjson.loads(self.config.custom_play_list_json)
         return self.custom_play_list
 
-    def save_custom_play_list(self):
+    def save_custom_play_list(self, changed_names=None):
         custom_play_list = self.get_custom_play_list()
-        self.refresh_custom_play_list()
-        self.config.custom_play_list_json = json.dumps(
-            custom_play_list, ensure_ascii=False
+        self.refresh_custom_play_list(changed_names)
+        self.config.custom_play_list_json = orjson.dumps(custom_play_list).decode(
+            "utf-8"
         )
         self.save_cur_config()
 
@@ -1167,7 +1426,7 @@ class XiaoMusic:
         if name in custom_play_list:
             return False
         custom_play_list[name] = []
-        self.save_custom_play_list()
+        self.save_custom_play_list([name])
         return True
 
     # 移除歌单
@@ -1176,7 +1435,7 @@ class XiaoMusic:
         if name not in custom_play_list:
             return False
         custom_play_list.pop(name)
-        self.save_custom_play_list()
+        self.save_custom_play_list([name])
         return True
 
     # 修改歌单名字
@@ -1191,7 +1450,7 @@ class XiaoMusic:
         play_list = custom_play_list[oldname]
         custom_play_list.pop(oldname)
         custom_play_list[newname] = play_list
-        self.save_custom_play_list()
+        self.save_custom_play_list([oldname, newname])
         return True
 
     # 获取所有自定义歌单
@@ -1215,12 +1474,14 @@ class XiaoMusic:
             if not self.play_list_add(name):
                 return False
         play_list = []
+        existing = set()
         for music_name in music_list:
-            if (music_name in self.all_music) and (music_name not in play_list):
+            if (music_name in self.all_music) and (music_name not in existing):
                 play_list.append(music_name)
+                existing.add(music_name)
         # 直接覆盖
         custom_play_list[name] = play_list
-        self.save_custom_play_list()
+        self.save_custom_play_list([name])
         return True
 
     # 歌单新增歌曲
@@ -1231,10 +1492,12 @@ class XiaoMusic:
             if not self.play_list_add(name):
                 return False
         play_list = custom_play_list[name]
+        existing = set(play_list)
         for music_name in music_list:
-            if (music_name in self.all_music) and (music_name not in play_list):
+            if (music_name in self.all_music) and (music_name not in existing):
                 play_list.append(music_name)
-        self.save_custom_play_list()
+                existing.add(music_name)
+        self.save_custom_play_list([name])
         return True
 
     # 歌单移除歌曲
@@ -1246,7 +1509,7 @@ class XiaoMusic:
         for music_name in music_list:
             if music_name in play_list:
                 play_list.remove(music_name)
-        self.save_custom_play_list()
+        self.save_custom_play_list([name])
         return True
 
     # 获取音量
@@ -1261,11 +1524,40 @@ class XiaoMusic:
         volume = int(arg1)
         return await self.devices[did].set_volume(volume)
 
+    # 新增一首本地歌曲，同步更新搜索索引
+    def add_local_music(self, name, filepath):
+        self.all_music[name] = filepath
+        self._web_music.discard(name)
+        self._exists_cache.pop(filepath, None)
+        # 网页搜索在线程里遍历索引，这里换成新对象而不是原地修改
+        self._search_index = {**self._search_index, **build_search_index([name])}
+        # 文件路径索引也要加上，已有的路径换了歌名时整个重建
+        is_new_path = filepath not in self._extra_index_search
+        self._extra_index_search[filepath] = name
+        if is_new_path:
+            self._extra_search_index = self._extra_search_index + (
+                build_extra_search_index({filepath: name})
+            )
+        else:
+            self._extra_search_index = build_extra_search_index(
+                self._extra_index_search
+            )
+        self._search_result_cache = {}
+
     # 搜索音乐
     def searchmusic(self, name):
-        all_music_list = list(self.all_music.keys())
-        search_list = fuzzyfinder(name, all_music_list, self._extra_index_search)
-        self.log.debug(f"searchmusic. name:{name} search_list:{search_list}")
+        # 网页搜索时会重复搜索同样的关键词，结果缓存到歌曲索引变化为止
+        cache = self._search_result_cache
+        search_list = cache.get(name)
+        if search_list is None:
+            search_list = fuzzyfinder_in_index(
+                name, self._search_index, self._extra_search_index
+            )
+            if len(cache) >= self._SEARCH_RESULT_CACHE_MAX:
+                cache.clear()
+            cache[name] = search_list
+        search_list = list(search_list)
+        self.log.debug("searchmusic. name:%s search_list:%s", name, search_list)
         return search_list
 
     # 获取播放列表
@@ -1336,7 +1628,7 @@ class XiaoMusic:
         self.config.update_config(data)
 
         self.init_config()
-        debug_config = deepcopy_data_no_sensitive_info(self.config)
+        debug_config = copy_data_no_sensitive_info(self.config)
         self.log.info(f"update_config_from_setting ok. data:{debug_config}")
 
         joined_keywords = "/".join(self.config.key_match_order)
@@ -1356,7 +1648,7 @@ class XiaoMusic:
         self._gen_all_music_list()
         self.update_devices()
 
-        debug_config = deepcopy_data_no_sensitive_info(self.config)
+        debug_config = copy_data_no_sensitive_info(self.config)
         self.log.info(f"reinit success. data:{debug_config}")
 
     # 获取所有设备
@@ -1681,7 +1973,9 @@ class XiaoMusicDevice:
         self.log.info(playing_info)
         # WTF xiaomi api
         is_playing = (
-            json.loads(playing_info.get("data", {}).get("info", "{}")).get("status", -1)
+            orjson.loads(playing_info.get("data", {}).get("info", "{}")).get(
+                "status", -1
+            )
             == 1
         )
         return is_playing
@@ -1776,7 +2070,7 @@ class XiaoMusicDevice:
     # 把下载的音乐加入播放列表
     async def add_download_music(self, name):
         filepath = os.path.join(self.download_path, f"{name}.mp3")
-        self.xiaomusic.all_music[name] = filepath
+        self.xiaomusic.add_local_music(name, filepath)
         # 应该很快，阻塞运行
         await self.xiaomusic._gen_all_music_tag({name: filepath})
         if name not in self._play_list:
@@ -1978,7 +2272,7 @@ class XiaoMusicDevice:
                 self.device_id
             )
             self.log.info(f"get_volume. playing_info:{playing_info}")
-            volume = json.loads(playing_info.get("data", {}).get("info", "{}")).get(
+            volume = orjson.loads(playing_info.get("data", {}).get("info", "{}")).get(
                 "volume", 0
             )
         except Exception as e: